@@ -11,3 +11,6 @@ For more details about the api, please check <https://developer.amazon.com/docs/
 __version__ = '2.0.1'
 
 from .client import Client
+from .signer import LocalSigner, RemoteSigner, SigningServer, SigningError
+from .reconciliation import Reconciler, SnapshotStore
+from .circuit_breaker import CircuitBreaker, CircuitOpenError
@@ -0,0 +1,262 @@
+import collections
+import logging
+import os
+import threading
+import time
+import weakref
+
+import requests
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+logger = logging.getLogger(__name__)
+
+# Breakers holding a lock that must be reinitialised in a forked child
+_breakers = weakref.WeakSet()
+
+
+class CircuitOpenError(Exception):
+
+    def __init__(self, key, retry_after):
+        """
+        Raised instead of sending a request while the circuit of its endpoint and operation is open
+        :param tuple key: circuit key `(host, operation)`
+        :param float retry_after: seconds before the circuit lets a probe request through
+        """
+        super().__init__('Circuit ' + ' '.join(key) + ' is open, retry after ' + format(retry_after, '.1f') + 's.')
+        self.key = key
+        self.retry_after = retry_after
+
+
+class _Circuit:
+
+    def __init__(self, window_size):
+        self.state = CLOSED
+        # incremented on every transition, calls admitted under an older generation are not counted
+        self.generation = 0
+        self.window = collections.deque(maxlen=window_size)
+        self.opened_at = None
+        self.probes = 0
+        self.probe_successes = 0
+
+
+class CircuitBreaker:
+
+    def __init__(self, failure_rate_threshold=0.5, slow_call_duration=None, slow_call_rate_threshold=1.0,
+                 window_size=20, minimum_calls=10, open_duration=30.0, half_open_max_calls=1,
+                 is_failure=None, failure_exceptions=(requests.RequestException,), on_state_change=None,
+                 clock=time.monotonic):
+        """
+        Circuit breaker keyed by endpoint host and operation.
+        A circuit opens when the rate of failed or slow calls among its last `window_size` calls reaches a threshold.
+        While open, calls fail fast with `CircuitOpenError`. After `open_duration` the circuit is half open and lets
+        `half_open_max_calls` probe calls through: if they all succeed it closes, otherwise it opens again
+        :param float failure_rate_threshold: (optional) rate of failed calls opening the circuit. Defaults to `0.5`.
+        :param float slow_call_duration: (optional) seconds after which a call is slow. Defaults to `None` (disabled).
+        :param float slow_call_rate_threshold: (optional) rate of slow calls opening the circuit. Defaults to `1.0`.
+        :param int window_size: (optional) number of last calls the rates are computed on. Defaults to `20`.
+        :param int minimum_calls: (optional) number of calls needed before the circuit can open. Defaults to `10`.
+        :param float open_duration: (optional) seconds the circuit stays open before probing. Defaults to `30.0`.
+        :param int half_open_max_calls: (optional) number of probe calls while half open. Defaults to `1`.
+        :param is_failure: (optional) function telling if a response is a failure.
+            Defaults to status code 429 or 5xx.
+        :param tuple failure_exceptions: (optional) exceptions counted as failures. Defaults to `requests.RequestException`.
+            Other exceptions are not counted, but still give back a half open probe slot.
+        :param on_state_change: (optional) function called with `(key, old_state, new_state)` on every transition.
+            Exceptions raised by listeners are logged and otherwise ignored
+        :param clock: (optional) monotonic clock. Defaults to `time.monotonic`.
+        """
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_duration = slow_call_duration
+        self.slow_call_rate_threshold = slow_call_rate_threshold
+        self.window_size = window_size
+        self.minimum_calls = minimum_calls
+        self.open_duration = open_duration
+        self.half_open_max_calls = half_open_max_calls
+        self.is_failure = is_failure if is_failure is not None else self.__is_failure
+        self.failure_exceptions = failure_exceptions
+        self.listeners = [on_state_change] if on_state_change is not None else []
+        self.clock = clock
+        self.__circuits = {}
+        self.__lock = threading.Lock()
+        _breakers.add(self)
+
+    def add_listener(self, listener):
+        """
+        Add a function called with `(key, old_state, new_state)` on every transition
+        :param listener: listener
+        """
+        self.listeners.append(listener)
+
+    def call(self, key, function):
+        """
+        Call the function through the circuit of the key
+        :param tuple key: circuit key `(host, operation)`
+        :param function: function sending the request
+        :return: response
+        :rtype: requests.Response
+        """
+        generation = self.__before(key)
+        started_at = self.clock()
+        failed = None
+        try:
+            response = function()
+            failed = self.is_failure(response)
+            return response
+        except self.failure_exceptions:
+            failed = True
+            raise
+        finally:
+            self.__after(key, generation, failed, self.clock() - started_at)
+
+    def check(self, key):
+        """
+        Fail fast if the circuit of the key would not let a call through, without taking a probe slot.
+        Used to skip preparing a request, e.g. signing it, that would be rejected anyway
+        :param tuple key: circuit key `(host, operation)`
+        """
+        with self.__lock:
+            circuit = self.__circuits.get(key)
+            if circuit is None:
+                return
+
+            if circuit.state == OPEN:
+                elapsed = self.clock() - circuit.opened_at
+                if elapsed < self.open_duration:
+                    raise CircuitOpenError(key, self.open_duration - elapsed)
+            elif circuit.state == HALF_OPEN and circuit.probes >= self.half_open_max_calls:
+                raise CircuitOpenError(key, 0.0)
+
+    def state(self, key):
+        """
+        Get the state of a circuit
+        :param tuple key: circuit key `(host, operation)`
+        :return: `closed / open / half_open`
+        :rtype: str
+        """
+        with self.__lock:
+            circuit = self.__circuits.get(key)
+            return circuit.state if circuit is not None else CLOSED
+
+    def states(self):
+        """
+        Get the state of every circuit used so far
+        :return: circuit key => state
+        :rtype: dict
+        """
+        with self.__lock:
+            return {key: circuit.state for key, circuit in self.__circuits.items()}
+
+    def reset(self, key=None):
+        """
+        Close a circuit, or every circuit if no key is given
+        :param tuple key: (optional) circuit key `(host, operation)`
+        """
+        with self.__lock:
+            keys = [key] if key is not None else list(self.__circuits)
+            transitions = [self.__transition(k, self.__circuit(k), CLOSED) for k in keys]
+        self.__notify(transitions)
+
+    def _after_fork(self):
+        # the lock may have been held by another thread of the parent, and the probes in flight
+        # belong to threads that do not exist in the child, so their slots would never be given back
+        self.__lock = threading.Lock()
+        for circuit in self.__circuits.values():
+            if circuit.state == HALF_OPEN:
+                circuit.generation += 1
+                circuit.probes = 0
+                circuit.probe_successes = 0
+
+    def __before(self, key):
+        transitions = []
+        with self.__lock:
+            circuit = self.__circuit(key)
+            if circuit.state == OPEN:
+                elapsed = self.clock() - circuit.opened_at
+                if elapsed < self.open_duration:
+                    raise CircuitOpenError(key, self.open_duration - elapsed)
+                transitions.append(self.__transition(key, circuit, HALF_OPEN))
+
+            if circuit.state == HALF_OPEN:
+                if circuit.probes >= self.half_open_max_calls:
+                    raise CircuitOpenError(key, 0.0)
+                circuit.probes += 1
+            generation = circuit.generation
+        self.__notify(transitions)
+        return generation
+
+    def __after(self, key, generation, failed, duration):
+        # `failed` is `None` when the call ended without a countable outcome, it only gives back its probe slot
+        slow = failed is not None and self.slow_call_duration is not None and duration >= self.slow_call_duration
+        transitions = []
+        with self.__lock:
+            circuit = self.__circuit(key)
+            if circuit.generation != generation:
+                return
+
+            if circuit.state == HALF_OPEN:
+                if failed is None:
+                    circuit.probes -= 1
+                elif failed or slow:
+                    transitions.append(self.__transition(key, circuit, OPEN))
+                else:
+                    circuit.probe_successes += 1
+                    if circuit.probe_successes >= self.half_open_max_calls:
+                        transitions.append(self.__transition(key, circuit, CLOSED))
+            elif circuit.state == CLOSED and failed is not None:
+                circuit.window.append((failed, slow))
+                if len(circuit.window) >= self.minimum_calls and self.__tripped(circuit.window):
+                    transitions.append(self.__transition(key, circuit, OPEN))
+        self.__notify(transitions)
+
+    def __tripped(self, window):
+        failure_rate = sum(1 for failed, _ in window if failed) / len(window)
+        if failure_rate >= self.failure_rate_threshold:
+            return True
+
+        if self.slow_call_duration is None:
+            return False
+
+        slow_call_rate = sum(1 for _, slow in window if slow) / len(window)
+        return slow_call_rate >= self.slow_call_rate_threshold
+
+    def __circuit(self, key):
+        if key not in self.__circuits:
+            self.__circuits[key] = _Circuit(self.window_size)
+        return self.__circuits[key]
+
+    def __transition(self, key, circuit, state):
+        old_state = circuit.state
+        circuit.state = state
+        circuit.generation += 1
+        circuit.window.clear()
+        circuit.probes = 0
+        circuit.probe_successes = 0
+        circuit.opened_at = self.clock() if state == OPEN else None
+        return key, old_state, state
+
+    def __notify(self, transitions):
+        for key, old_state, new_state in transitions:
+            if old_state == new_state:
+                continue
+            for listener in self.listeners:
+                # a failing listener must neither lose a probe slot nor replace the response of a call
+                try:
+                    listener(key, old_state, new_state)
+                except Exception:
+                    logger.exception('Circuit breaker listener failed on %s: %s -> %s', ' '.join(key), old_state, new_state)
+
+    @staticmethod
+    def __is_failure(response):
+        return response.status_code == 429 or response.status_code >= 500
+
+
+def _reset_breakers():
+    for breaker in list(_breakers):
+        breaker._after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_breakers)
@@ -1,20 +1,92 @@
+import collections
 import datetime
-import base64
+import http.cookiejar
+import os
+import threading
+import types
 import uuid
+import weakref
 import json
 import urllib.parse
 
 import requests
-from Crypto.Signature import pss
+import requests.adapters
 from Crypto.Hash import SHA256
-from Crypto.PublicKey import RSA
+
+from .signer import LocalSigner
 
 AMAZON_SIGNATURE_ALGORITHM = 'AMZN-PAY-RSASSA-PSS'
 
 
-class Client:
+Config = collections.namedtuple('Config', ['public_key_id', 'private_key', 'region', 'endpoint', 'sandbox', 'signer', 'circuit_breaker', 'headers'])
+
+# Transports must not be shared between a process and its forked children
+_transports = weakref.WeakSet()
+
+
+class _Transport:
+
+    def __init__(self):
+        """
+        Connection pool and lock shared by a client and the clients derived from it
+        """
+        self.reset()
+        _transports.add(self)
+
+    def reset(self):
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.adapter = requests.adapters.HTTPAdapter()
+        self.local = threading.local()
+
+    def get_session(self):
+        if self.pid != os.getpid():
+            # forked without `os.register_at_fork` support
+            self.reset()
+
+        # sessions are not shared between threads, only the connection pool of the adapter is
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+            session.mount('https://', self.adapter)
+            session.mount('http://', self.adapter)
+            self.local.session = session
+
+        return session
+
+
+def _reset_transports():
+    for transport in list(_transports):
+        transport.reset()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_transports)
 
-    def __init__(self, public_key_id=None, private_key=None, region=None, sandbox=False):
+
+class Client:
+    """
+    Amazon Pay Client
+
+    Thread safety:
+    The configuration is held in an immutable `Config` snapshot. `setup`, `with_config` and attribute assignment
+    never modify a snapshot, they build a new one and swap it in with a single reference assignment.
+    Every call reads the snapshot once and uses it for the whole call, so a request is always built, signed
+    and sent with one consistent configuration, even while another thread reconfigures the client.
+    The parsed private key and the urllib3 connection pool are shared and safe to use from several threads.
+    Each thread sends its requests through its own `requests.Session`, and no cookies are stored, so nothing
+    from one thread's or one merchant's responses is sent with another request.
+    One client, or clients derived with `with_config`, can serve a whole thread pool.
+
+    Fork safety:
+    After a fork the child gets a new connection pool, new signer connections and new circuit breaker locks,
+    while the parsed private key and precomputed configuration are inherited.
+    Call `warm_up` in a pre-fork master so workers start ready.
+    """
+
+    def __init__(self, public_key_id=None, private_key=None, region=None, sandbox=False, signer=None,
+                 circuit_breaker=None):
         """
         Amazon Pay Client
         All parameters can be set later using `setup` function
@@ -22,26 +94,149 @@ class Client:
         :param str private_key: (optional) path of private key ID
         :param str region: (optional) region `EU / DE / UK / US / NA / JP`
         :param bool sandbox: (optional) environment SANDBOX(`True`) / LIVE(`False`). Defaults to `False`.
+        :param signer: (optional) signer used instead of the private key, e.g. `RemoteSigner`.
+            It is called as `signer.sign(string_to_sign, public_key_id)` with the public key ID of the configuration.
+            Defaults to a `LocalSigner` of `private_key`.
+        :param CircuitBreaker circuit_breaker: (optional) circuit breaker requests go through,
+            keyed by endpoint host and operation. Defaults to `None` (disabled).
         """
-        self.setup(public_key_id, private_key, region, sandbox)
+        self.__transport = _Transport()
+        self.__config = Config(None, None, None, None, False, None, None, None)
+        self.setup(public_key_id, private_key, region, sandbox, signer, circuit_breaker)
 
-    def setup(self, public_key_id=None, private_key=None, region=None, sandbox=False):
+    def setup(self, public_key_id=None, private_key=None, region=None, sandbox=False, signer=None,
+              circuit_breaker=None):
         """
         Setup of the client configuration
         :param str public_key_id: (optional) public key ID
         :param str private_key: (optional) path of private key ID
         :param str region: (optional) region `EU / DE / UK / US / NA / JP`
         :param bool sandbox: (optional) environment SANDBOX(`True`) / LIVE(`False`). Defaults to `False`.
+        :param signer: (optional) signer used instead of the private key, e.g. `RemoteSigner`.
+            It is called as `signer.sign(string_to_sign, public_key_id)` with the public key ID of the configuration.
+            Defaults to a `LocalSigner` of `private_key`.
+        :param CircuitBreaker circuit_breaker: (optional) circuit breaker requests go through,
+            keyed by endpoint host and operation. Defaults to `None` (disabled).
+        :return: self
+        """
+        with self.__transport.lock:
+            current = self.__config
+            if signer is None:
+                if isinstance(current.signer, LocalSigner) and current.signer.private_key == private_key:
+                    signer = current.signer
+                else:
+                    signer = LocalSigner(private_key)
+
+            self.__config = self.__build_config(current, {
+                'public_key_id': public_key_id,
+                'private_key': private_key,
+                'region': region,
+                'sandbox': sandbox,
+                'signer': signer,
+                'circuit_breaker': circuit_breaker,
+            })
+        return self
+
+    def with_config(self, **changes):
+        """
+        Derive a new client from the current configuration.
+        The new client shares the connection pool, and the parsed private key unless `private_key` or `signer` is changed
+        :param changes: configuration to change.
+            `public_key_id / private_key / region / endpoint / sandbox / signer / circuit_breaker`.
+            `endpoint` overrides the endpoint of the region, e.g. to point at a mock server
+        :return: new client
+        :rtype: Client
+        """
+        if 'headers' in changes:
+            raise TypeError('headers is derived from region and endpoint and cannot be set.')
+
+        current = self.__config
+        if changes.get('signer') is None:
+            if 'private_key' in changes and changes['private_key'] != current.private_key:
+                changes['signer'] = LocalSigner(changes['private_key'])
+            else:
+                changes['signer'] = current.signer
+
+        client = type(self).__new__(type(self))
+        client.__transport = self.__transport
+        client.__config = self.__build_config(current, changes)
+        return client
+
+    def warm_up(self):
+        """
+        Load and parse the private key ahead of the first request.
+        Call it in a pre-fork master process so that workers inherit the parsed key
         :return: self
         """
-        self.public_key_id = public_key_id
-        self.private_key = private_key
-        if region is not None:
-            self.region = region
-            self.__setup_endpoint()
-        self.sandbox = sandbox
+        signer = self.__config.signer
+        if hasattr(signer, 'load'):
+            signer.load()
         return self
 
+    @property
+    def config(self):
+        """
+        Current configuration snapshot
+        :rtype: Config
+        """
+        return self.__config
+
+    @property
+    def public_key_id(self):
+        return self.__config.public_key_id
+
+    @public_key_id.setter
+    def public_key_id(self, public_key_id):
+        self.__update({'public_key_id': public_key_id})
+
+    @property
+    def private_key(self):
+        return self.__config.private_key
+
+    @private_key.setter
+    def private_key(self, private_key):
+        self.__update({'private_key': private_key, 'signer': LocalSigner(private_key)})
+
+    @property
+    def region(self):
+        return self.__config.region
+
+    @region.setter
+    def region(self, region):
+        self.__update({'region': region})
+
+    @property
+    def endpoint(self):
+        return self.__config.endpoint
+
+    @endpoint.setter
+    def endpoint(self, endpoint):
+        self.__update({'endpoint': endpoint})
+
+    @property
+    def sandbox(self):
+        return self.__config.sandbox
+
+    @sandbox.setter
+    def sandbox(self, sandbox):
+        self.__update({'sandbox': sandbox})
+
+    @property
+    def signer(self):
+        return self.__config.signer
+
+    @signer.setter
+    def signer(self, signer):
+        self.__update({'signer': signer})
+
+    @property
+    def circuit_breaker(self):
+        return self.__config.circuit_breaker
+
+    @circuit_breaker.setter
+    def circuit_breaker(self, circuit_breaker):
+        self.__update({'circuit_breaker': circuit_breaker})
+
     def get_buyer(self, buyer_token):
         """
         Amazon Checkout v2 - Get Buyer
@@ -273,11 +468,22 @@ class Client:
         else:
             payload = json.dumps(body)
 
-        api = self.__build_api(api)
-        headers = self.__build_headers(method, api, query, payload)
-        url = self.__build_url(api, query)
+        config = self.__config
+        breaker = config.circuit_breaker
+        if breaker is not None:
+            key = (config.headers['X-Amz-Pay-Host'], self.__build_operation(method, api))
+            breaker.check(key)
+
+        api = self.__build_api(config, api)
+        headers = self.__build_headers(config, method, api, query, payload)
+        url = self.__build_url(config, api, query)
+        session = self.__transport.get_session()
 
-        return requests.request(method, url, data=payload, headers=headers)
+        # only the HTTP call goes through the circuit, signing errors and time are not endpoint failures
+        if breaker is None:
+            return session.request(method, url, data=payload, headers=headers)
+
+        return breaker.call(key, lambda: session.request(method, url, data=payload, headers=headers))
 
     def generate_button_signature(self, payload):
         """
@@ -292,20 +498,15 @@ class Client:
 
         hashed_button_request = AMAZON_SIGNATURE_ALGORITHM + '\n' + self.__hash_and_hex(payload or '')
 
-        return self.__sign_signature(hashed_button_request)
+        return self.__sign_signature(self.__config, hashed_button_request)
 
-    def __build_headers(self, method, api, query, payload):
+    def __build_headers(self, config, method, api, query, payload):
         timestamp = datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
 
         query_string = self.__build_query_string(query)
 
-        headers = {
-            'Accept': 'application/json',
-            'Content-Type': 'application/json',
-            'X-Amz-Pay-Region': self.region,
-            'X-Amz-Pay-Date': timestamp,
-            'X-Amz-Pay-Host': urllib.parse.urlparse(self.endpoint).netloc or '/',
-        }
+        headers = dict(config.headers)
+        headers['X-Amz-Pay-Date'] = timestamp
 
         if method.lower() == 'post':
             headers['X-Amz-Pay-Idempotency-Key'] = uuid.uuid4().hex
@@ -325,10 +526,10 @@ class Client:
 
         string_to_sign = AMAZON_SIGNATURE_ALGORITHM + '\n' + self.__hash_and_hex(canonical_request)
 
-        signature = self.__sign_signature(string_to_sign)
+        signature = self.__sign_signature(config, string_to_sign)
 
         headers['Authorization'] = AMAZON_SIGNATURE_ALGORITHM + \
-                                   ' PublicKeyId=' + self.public_key_id + ',' \
+                                   ' PublicKeyId=' + config.public_key_id + ',' \
                                    ' SignedHeaders=' + ';'.join(signed_header_list) + ',' \
                                    ' Signature=' + signature
 
@@ -346,38 +547,66 @@ class Client:
 
         return '&'.join(query_list)
 
-    def __build_url(self, api, query):
-        url = self.endpoint + api
+    def __build_url(self, config, api, query):
+        url = config.endpoint + api
         query_string = self.__build_query_string(query)
         if query_string != '':
             url = url + '?' + query_string
 
         return url
 
-    def __build_api(self, api):
+    @staticmethod
+    def __build_api(config, api):
         api = '/v2' + api
-        if self.public_key_id.startswith('LIVE') or self.public_key_id.startswith('SANDBOX'):
+        if config.public_key_id.startswith('LIVE') or config.public_key_id.startswith('SANDBOX'):
             return api
 
-        return '/' + ('sandbox' if self.sandbox else 'live') + api
+        return '/' + ('sandbox' if config.sandbox else 'live') + api
+
+    @staticmethod
+    def __build_operation(method, api):
+        # resource identifiers sit at every second path segment, e.g. /charges/{id}/capture
+        segments = api.split('/')
+        for i in range(2, len(segments), 2):
+            segments[i] = '{id}'
+
+        return method.upper() + ' ' + '/'.join(segments)
 
     @staticmethod
     def __hash_and_hex(string):
         return SHA256.new(string.encode()).hexdigest()
 
-    def __sign_signature(self, string_to_sign):
-        if self.private_key.find('BEGIN RSA PRIVATE KEY') != -1 and self.private_key.find('BEGIN PRIVATE KEY') != -1:
-            private = self.private_key
-        else:
-            private_key = open(self.private_key, 'r')
-            private = private_key.read()
-            private_key.close()
+    @staticmethod
+    def __sign_signature(config, string_to_sign):
+        return config.signer.sign(string_to_sign, config.public_key_id)
+
+    def __update(self, changes):
+        with self.__transport.lock:
+            self.__config = self.__build_config(self.__config, changes)
+
+    @classmethod
+    def __build_config(cls, current, changes):
+        config = current._replace(**changes)
+        if changes.get('region') is None:
+            config = config._replace(region=current.region)
+        if changes.get('endpoint') is None:
+            # an explicit endpoint wins, otherwise it follows the region
+            if changes.get('region') is not None:
+                config = config._replace(endpoint=cls.__build_endpoint(config.region))
+            else:
+                config = config._replace(endpoint=current.endpoint)
+
+        headers = {
+            'Accept': 'application/json',
+            'Content-Type': 'application/json',
+            'X-Amz-Pay-Region': config.region,
+            'X-Amz-Pay-Host': urllib.parse.urlparse(config.endpoint or '').netloc or '/',
+        }
 
-        rsa = RSA.import_key(private)
-        signature = pss.new(rsa, salt_bytes=20).sign(SHA256.new(string_to_sign.encode()))
-        return base64.b64encode(signature).decode()
+        return config._replace(headers=types.MappingProxyType(headers))
 
-    def __setup_endpoint(self):
+    @staticmethod
+    def __build_endpoint(region):
         region_mappings = {
             'eu': 'eu',
             'de': 'eu',
@@ -393,9 +622,7 @@ class Client:
             'jp': 'pay-api.amazon.jp'
         }
 
-        region = self.region.lower()
-        if region not in region_mappings:
-            raise Exception(self.region + ' is not a valid region.')
+        if region.lower() not in region_mappings:
+            raise Exception(region + ' is not a valid region.')
 
-        self.endpoint = 'https://' + endpoint_mappings[region]
-        return self
+        return 'https://' + endpoint_mappings[region_mappings[region.lower()]]
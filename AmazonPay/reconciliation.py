@@ -0,0 +1,289 @@
+import collections
+import concurrent.futures
+import itertools
+import json
+import sqlite3
+import threading
+import time
+
+CHARGE_PERMISSION = 'chargePermission'
+CHARGE = 'charge'
+
+# States an object can never leave, these are not checked again once reached
+TERMINAL_STATES = {
+    CHARGE_PERMISSION: {'Closed'},
+    CHARGE: {'Captured', 'Canceled', 'Declined'},
+}
+
+# States expected to change shortly, these are checked before the others
+TRANSITIONAL_STATES = {
+    CHARGE_PERMISSION: set(),
+    CHARGE: {'AuthorizationInitiated', 'CaptureInitiated'},
+}
+
+PRIORITY_UNCHECKED = 0
+PRIORITY_TRANSITIONAL = 1
+PRIORITY_OPEN = 2
+PRIORITY_TERMINAL = 3
+
+Snapshot = collections.namedtuple('Snapshot', ['object_type', 'object_id', 'state', 'data', 'last_checked', 'last_changed', 'failures'])
+
+Change = collections.namedtuple('Change', ['object_type', 'object_id', 'previous_state', 'state', 'previous', 'current'])
+
+Failure = collections.namedtuple('Failure', ['object_type', 'object_id', 'error'])
+
+
+class SnapshotStore:
+
+    def __init__(self, path=':memory:'):
+        """
+        SQLite store of the last known state of Amazon Pay objects
+        :param str path: (optional) path of the SQLite database. Defaults to an in-memory database.
+        """
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.__lock = threading.Lock()
+        with self.__lock, self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS snapshots ('
+                ' object_type TEXT NOT NULL,'
+                ' object_id TEXT NOT NULL,'
+                ' state TEXT,'
+                ' data TEXT,'
+                ' priority INTEGER NOT NULL,'
+                ' last_checked REAL,'
+                ' last_changed REAL,'
+                ' failures INTEGER NOT NULL DEFAULT 0,'
+                ' retry_at REAL,'
+                ' PRIMARY KEY (object_type, object_id))'
+            )
+            # stores created before failed checks were backed off
+            columns = {row[1] for row in self.connection.execute('PRAGMA table_info(snapshots)')}
+            if 'failures' not in columns:
+                self.connection.execute('ALTER TABLE snapshots ADD COLUMN failures INTEGER NOT NULL DEFAULT 0')
+            if 'retry_at' not in columns:
+                self.connection.execute('ALTER TABLE snapshots ADD COLUMN retry_at REAL')
+            self.connection.execute(
+                'CREATE INDEX IF NOT EXISTS snapshots_due ON snapshots (priority, last_checked)'
+            )
+
+    def track(self, object_type, object_ids):
+        """
+        Start tracking objects. Objects already tracked are left untouched
+        :param str object_type: `chargePermission / charge`
+        :param object_ids: iterable of object identifiers
+        """
+        if object_type not in TERMINAL_STATES:
+            raise Exception(object_type + ' is not a valid object type.')
+
+        with self.__lock, self.connection:
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO snapshots (object_type, object_id, priority) VALUES (?, ?, ?)',
+                ((object_type, object_id, PRIORITY_UNCHECKED) for object_id in object_ids)
+            )
+
+    def get(self, object_type, object_id):
+        """
+        Get the last known snapshot of an object
+        :param str object_type: `chargePermission / charge`
+        :param str object_id: object identifier
+        :return: snapshot, or `None` if the object is not tracked
+        :rtype: Snapshot
+        """
+        with self.__lock:
+            row = self.connection.execute(
+                'SELECT object_type, object_id, state, data, last_checked, last_changed, failures FROM snapshots'
+                ' WHERE object_type = ? AND object_id = ?',
+                (object_type, object_id)
+            ).fetchone()
+
+        return self.__to_snapshot(row) if row is not None else None
+
+    def due(self, checked_before, limit=None, include_terminal=False, retry_before=None):
+        """
+        Get the snapshots to check, most likely to have changed first:
+        never checked, then transitional states, then other open states, each by oldest check.
+        Objects whose last check failed come after all the others
+        :param float checked_before: only objects not checked since this timestamp are returned
+        :param int limit: (optional) maximum number of snapshots to return
+        :param bool include_terminal: (optional) also return objects in a terminal state. Defaults to `False`.
+        :param float retry_before: (optional) only return failed objects whose backoff ends before this timestamp.
+            Defaults to `None` (failed objects are returned regardless of their backoff).
+        :return: snapshots
+        :rtype: list
+        """
+        sql = 'SELECT object_type, object_id, state, data, last_checked, last_changed, failures FROM snapshots' \
+              ' WHERE (last_checked IS NULL OR last_checked < ?)'
+        parameters = [checked_before]
+        if not include_terminal:
+            sql += ' AND priority < ?'
+            parameters.append(PRIORITY_TERMINAL)
+        if retry_before is not None:
+            sql += ' AND (retry_at IS NULL OR retry_at <= ?)'
+            parameters.append(retry_before)
+        sql += ' ORDER BY failures > 0, priority, last_checked'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            parameters.append(limit)
+
+        with self.__lock:
+            rows = self.connection.execute(sql, parameters).fetchall()
+
+        return [self.__to_snapshot(row) for row in rows]
+
+    def save(self, object_type, object_id, state, data, checked_at, changed):
+        """
+        Record the result of a check
+        :param str object_type: `chargePermission / charge`
+        :param str object_id: object identifier
+        :param str state: current state of the object
+        :param dict data: current object as returned by the API
+        :param float checked_at: timestamp of the check
+        :param bool changed: whether the object changed since the last check
+        """
+        if state in TERMINAL_STATES[object_type]:
+            priority = PRIORITY_TERMINAL
+        elif state in TRANSITIONAL_STATES[object_type]:
+            priority = PRIORITY_TRANSITIONAL
+        else:
+            priority = PRIORITY_OPEN
+
+        with self.__lock, self.connection:
+            self.connection.execute(
+                'UPDATE snapshots SET state = ?, data = ?, priority = ?, last_checked = ?,'
+                ' last_changed = CASE WHEN ? THEN ? ELSE last_changed END, failures = 0, retry_at = NULL'
+                ' WHERE object_type = ? AND object_id = ?',
+                (state, json.dumps(data, sort_keys=True), priority, checked_at, changed, checked_at, object_type, object_id)
+            )
+
+    def fail(self, object_type, object_id, attempted_at, backoff, max_backoff):
+        """
+        Record a failed check. The object is not due again before `backoff` seconds,
+        doubled for every consecutive failure up to `max_backoff` seconds
+        :param str object_type: `chargePermission / charge`
+        :param str object_id: object identifier
+        :param float attempted_at: timestamp of the check
+        :param float backoff: seconds before an object is checked again after its first failure
+        :param float max_backoff: maximum seconds before an object is checked again
+        """
+        with self.__lock, self.connection:
+            self.connection.execute(
+                'UPDATE snapshots SET failures = failures + 1,'
+                ' retry_at = ? + MIN(?, ? * (1 << MIN(failures, 30)))'
+                ' WHERE object_type = ? AND object_id = ?',
+                (attempted_at, max_backoff, backoff, object_type, object_id)
+            )
+
+    def close(self):
+        self.connection.close()
+
+    @staticmethod
+    def __to_snapshot(row):
+        object_type, object_id, state, data, last_checked, last_changed, failures = row
+        return Snapshot(object_type, object_id, state, json.loads(data) if data is not None else None, last_checked, last_changed, failures)
+
+
+class Reconciler:
+
+    def __init__(self, client, store, max_workers=8, min_interval=0, failure_backoff=3600, max_failure_backoff=604800):
+        """
+        Incremental reconciliation of Charge Permissions and Charges against a local snapshot store.
+        Each run only checks objects whose state can still change, most likely to have changed first,
+        and yields the objects that changed since their last check
+        :param AmazonPay.Client client: client used to call the API
+        :param SnapshotStore store: snapshot store
+        :param int max_workers: (optional) maximum number of concurrent API calls. Defaults to `8`.
+        :param float min_interval: (optional) seconds before an object is checked again. Defaults to `0`.
+        :param float failure_backoff: (optional) seconds before an object whose check failed is checked again,
+            doubled for every consecutive failure. Defaults to `3600`.
+        :param float max_failure_backoff: (optional) maximum seconds before an object whose check failed
+            is checked again. Defaults to `604800` (7 days).
+        """
+        self.client = client
+        self.store = store
+        self.max_workers = max_workers
+        self.min_interval = min_interval
+        self.failure_backoff = failure_backoff
+        self.max_failure_backoff = max_failure_backoff
+        self.failures = []
+
+    def track(self, object_type, object_ids):
+        """
+        Start tracking objects
+        :param str object_type: `chargePermission / charge`
+        :param object_ids: iterable of object identifiers
+        """
+        self.store.track(object_type, object_ids)
+
+    def run(self, limit=None, force=False):
+        """
+        Check the due objects and yield the changes.
+        Each result is saved as soon as its check completes. If the caller stops consuming the changes early,
+        checks not started yet are skipped and remain due for the next run.
+        Objects that could not be checked keep their last known state, are collected in `failures`
+        and are backed off, so that they are not checked again before `failure_backoff`
+        :param int limit: (optional) maximum number of objects to check
+        :param bool force: (optional) check all objects, including terminal, recently checked and backed off ones.
+            Defaults to `False`.
+        :return: generator of changes
+        :rtype: collections.Iterable[Change]
+        """
+        self.failures = []
+        started_at = time.time()
+        checked_before = started_at + 1 if force else started_at - self.min_interval
+        snapshots = iter(self.store.due(
+            checked_before, limit, include_terminal=force, retry_before=None if force else started_at
+        ))
+
+        # at most `max_workers` checks are in flight, so a caller that stops early only waits for those
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers)
+        in_flight = {}
+        try:
+            for snapshot in itertools.islice(snapshots, self.max_workers):
+                in_flight[executor.submit(self.__fetch, snapshot)] = snapshot
+
+            while in_flight:
+                done, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+                changes = []
+                for future in done:
+                    change = self.__record(in_flight.pop(future), future)
+                    if change is not None:
+                        changes.append(change)
+
+                for snapshot in itertools.islice(snapshots, len(done)):
+                    in_flight[executor.submit(self.__fetch, snapshot)] = snapshot
+
+                for change in changes:
+                    yield change
+        finally:
+            executor.shutdown(wait=True)
+            for future, snapshot in in_flight.items():
+                self.__record(snapshot, future)
+
+    def __record(self, snapshot, future):
+        try:
+            current = future.result()
+        except Exception as e:
+            self.failures.append(Failure(snapshot.object_type, snapshot.object_id, e))
+            self.store.fail(snapshot.object_type, snapshot.object_id, time.time(),
+                            self.failure_backoff, self.max_failure_backoff)
+            return None
+
+        state = current.get('statusDetails', {}).get('state')
+        changed = current != snapshot.data
+        self.store.save(snapshot.object_type, snapshot.object_id, state, current, time.time(), changed)
+
+        if not changed:
+            return None
+
+        return Change(snapshot.object_type, snapshot.object_id, snapshot.state, state, snapshot.data, current)
+
+    def __fetch(self, snapshot):
+        if snapshot.object_type == CHARGE_PERMISSION:
+            response = self.client.get_charge_permission(snapshot.object_id)
+        else:
+            response = self.client.get_charge(snapshot.object_id)
+
+        if response.status_code != 200:
+            raise Exception('Status Code: ' + str(response.status_code) + '\n' + 'Content: ' + response.content.decode(encoding='utf-8'))
+
+        return response.json()
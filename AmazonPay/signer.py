@@ -0,0 +1,442 @@
+import base64
+import os
+import socket
+import socketserver
+import struct
+import threading
+import weakref
+
+from Crypto.Signature import pss
+from Crypto.Hash import SHA256
+from Crypto.PublicKey import RSA
+
+# Request frame: request id, opcode, key id length, payload length, followed by key id and payload bytes
+REQUEST_HEADER = struct.Struct('>IBHI')
+# Response frame: request id, status, body length, followed by body bytes
+RESPONSE_HEADER = struct.Struct('>IBI')
+
+OP_SIGN = 1
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+# Signers holding locks or connections that must be reinitialised in a forked child
+_signers = weakref.WeakSet()
+
+
+class SigningError(Exception):
+    pass
+
+
+class LocalSigner:
+
+    def __init__(self, private_key=None):
+        """
+        Sign in the current process with the merchant private key.
+        The key is read and parsed once, on first use, and kept for the lifetime of the signer
+        :param str private_key: (optional) path of private key or the private key content
+        """
+        self.private_key = private_key
+        self.__rsa = None
+        self.__lock = threading.Lock()
+        _signers.add(self)
+
+    def load(self):
+        """
+        Read and parse the private key if it has not been done yet
+        :return: parsed RSA key
+        :rtype: Crypto.PublicKey.RSA.RsaKey
+        """
+        if self.__rsa is None:
+            with self.__lock:
+                if self.__rsa is None:
+                    self.__rsa = RSA.import_key(self.__read_private_key())
+
+        return self.__rsa
+
+    def sign(self, string_to_sign, public_key_id=None):
+        """
+        Sign the string to sign using RSASSA-PSS algorithm with SHA256 hashing
+        :param str string_to_sign: string to sign
+        :param str public_key_id: (optional) unused, the signer holds a single key
+        :return: base64 encoded signature
+        :rtype: str
+        """
+        return base64.b64encode(self.sign_raw(string_to_sign.encode())).decode()
+
+    def sign_many(self, strings_to_sign, public_key_id=None):
+        """
+        Sign several strings to sign
+        :param list strings_to_sign: strings to sign
+        :param str public_key_id: (optional) unused, the signer holds a single key
+        :return: base64 encoded signatures, in the same order
+        :rtype: list
+        """
+        return [self.sign(string_to_sign) for string_to_sign in strings_to_sign]
+
+    def sign_raw(self, data):
+        """
+        Sign raw bytes
+        :param bytes data: data to sign
+        :return: signature
+        :rtype: bytes
+        """
+        return pss.new(self.load(), salt_bytes=20).sign(SHA256.new(data))
+
+    def close(self):
+        pass
+
+    def reset(self):
+        """
+        Reinitialise after a fork. The parsed key is kept, so children inherit it
+        """
+        self.__lock = threading.Lock()
+
+    def __read_private_key(self):
+        if self.private_key is None:
+            raise SigningError('Private key is not set.')
+
+        if self.private_key.find('BEGIN RSA PRIVATE KEY') != -1 or self.private_key.find('BEGIN PRIVATE KEY') != -1:
+            return self.private_key
+
+        with open(self.private_key, 'r') as private_key:
+            return private_key.read()
+
+
+class _PendingSignature:
+
+    def __init__(self, string_to_sign, key_id):
+        self.string_to_sign = string_to_sign
+        self.key_id = key_id
+        self.signature = None
+        self.error = None
+        self.lead = False
+        self.done = threading.Event()
+
+    def result(self):
+        if self.error is not None:
+            raise self.error
+        return self.signature
+
+
+class RemoteSigner:
+
+    def __init__(self, socket_path, public_key_id='', timeout=5.0, max_idle_connections=4, batch=True):
+        """
+        Sign through a `SigningServer` listening on a Unix socket, so that the private key
+        never has to be loaded in the current process.
+        Connections are kept open and reused, and `sign_many` pipelines all requests on one connection.
+        With `batch`, `sign` calls made concurrently from several threads are sent together as one pipelined batch
+        :param str socket_path: path of the Unix socket the signing server listens on
+        :param str public_key_id: (optional) public key ID of the key to sign with when a call does not give one.
+            May be empty if the server holds a single key
+        :param float timeout: (optional) socket timeout in seconds. Defaults to `5.0`.
+        :param int max_idle_connections: (optional) number of idle connections kept for reuse. Defaults to `4`.
+        :param bool batch: (optional) batch concurrent `sign` calls. Defaults to `True`.
+        """
+        self.socket_path = socket_path
+        self.public_key_id = public_key_id or ''
+        self.timeout = timeout
+        self.max_idle_connections = max_idle_connections
+        self.batch = batch
+        self.__request_id = 0
+        self.reset()
+        _signers.add(self)
+
+    def sign(self, string_to_sign, public_key_id=None):
+        """
+        Sign the string to sign on the signing server.
+        While a batch is in flight, calls from other threads are queued and sent together in the next batch
+        :param str string_to_sign: string to sign
+        :param str public_key_id: (optional) public key ID of the key to sign with. Defaults to the signer's one.
+        :return: base64 encoded signature
+        :rtype: str
+        """
+        if not self.batch:
+            return self.sign_many([string_to_sign], public_key_id)[0]
+
+        pending = _PendingSignature(string_to_sign, self.__key_id(public_key_id))
+        with self.__batch_lock:
+            self.__pending.append(pending)
+            lead = not self.__batching
+            self.__batching = True
+
+        if not lead:
+            pending.done.wait()
+            lead = pending.lead and pending.signature is None and pending.error is None
+        if lead:
+            self.__flush()
+
+        return pending.result()
+
+    def sign_many(self, strings_to_sign, public_key_id=None):
+        """
+        Sign several strings to sign in one round trip.
+        All requests are written before any response is read
+        :param list strings_to_sign: strings to sign
+        :param str public_key_id: (optional) public key ID of the key to sign with. Defaults to the signer's one.
+        :return: base64 encoded signatures, in the same order
+        :rtype: list
+        """
+        key_id = self.__key_id(public_key_id)
+        results = self.__sign_batch([(string_to_sign, key_id) for string_to_sign in strings_to_sign])
+        for result in results:
+            if isinstance(result, SigningError):
+                raise result
+
+        return results
+
+    def close(self):
+        """
+        Close all idle connections
+        """
+        with self.__lock:
+            idle, self.__idle = self.__idle, []
+        for connection in idle:
+            connection.close()
+
+    def reset(self):
+        """
+        Reinitialise after a fork. Idle connections belong to the parent and are dropped without being used
+        """
+        self.__idle = []
+        self.__lock = threading.Lock()
+        self.__pending = []
+        self.__batching = False
+        self.__batch_lock = threading.Lock()
+        self.__pid = os.getpid()
+
+    def __flush(self):
+        with self.__batch_lock:
+            batch, self.__pending = self.__pending, []
+
+        try:
+            for pending, result in zip(batch, self.__sign_batch([(pending.string_to_sign, pending.key_id) for pending in batch])):
+                if isinstance(result, SigningError):
+                    pending.error = result
+                else:
+                    pending.signature = result
+        except BaseException as e:
+            for pending in batch:
+                pending.error = e if isinstance(e, Exception) else SigningError('Signing interrupted.')
+            raise
+        finally:
+            with self.__batch_lock:
+                if self.__pending:
+                    # hand the next batch over to one of the threads waiting for it
+                    self.__pending[0].lead = True
+                    self.__pending[0].done.set()
+                else:
+                    self.__batching = False
+            for pending in batch:
+                pending.done.set()
+
+    def __key_id(self, public_key_id):
+        return (public_key_id if public_key_id is not None else self.public_key_id).encode()
+
+    def __sign_batch(self, batch):
+        if not batch:
+            return []
+
+        request_ids = self.__next_request_ids(len(batch))
+        frames = b''.join(
+            encode_request(request_id, OP_SIGN, key_id, string_to_sign.encode())
+            for request_id, (string_to_sign, key_id) in zip(request_ids, batch)
+        )
+
+        results = []
+        for request_id, (response_id, status, body) in zip(request_ids, self.__exchange(frames, len(request_ids))):
+            if response_id != request_id:
+                raise SigningError('Unexpected response ' + str(response_id) + ' for request ' + str(request_id) + '.')
+            if status != STATUS_OK:
+                results.append(SigningError(body.decode(errors='replace')))
+            else:
+                results.append(base64.b64encode(body).decode())
+
+        return results
+
+    def __exchange(self, frames, count):
+        connection, reused = self.__acquire()
+        try:
+            return self.__round_trip(connection, frames, count)
+        except socket.timeout:
+            raise
+        except (OSError, EOFError):
+            if not reused:
+                raise
+
+        # the reused connection may have been closed by the server, retry once on a fresh one
+        return self.__round_trip(self.__connect(), frames, count)
+
+    def __round_trip(self, connection, frames, count):
+        try:
+            connection.sendall(frames)
+            responses = [read_response(connection) for _ in range(count)]
+        except BaseException:
+            connection.close()
+            raise
+
+        self.__release(connection)
+        return responses
+
+    def __acquire(self):
+        if self.__pid != os.getpid():
+            self.reset()
+
+        with self.__lock:
+            if self.__idle:
+                return self.__idle.pop(), True
+
+        return self.__connect(), False
+
+    def __connect(self):
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.settimeout(self.timeout)
+        try:
+            connection.connect(self.socket_path)
+        except BaseException:
+            connection.close()
+            raise
+
+        return connection
+
+    def __release(self, connection):
+        with self.__lock:
+            if len(self.__idle) < self.max_idle_connections:
+                self.__idle.append(connection)
+                return
+        connection.close()
+
+    def __next_request_ids(self, count):
+        with self.__lock:
+            first = self.__request_id
+            self.__request_id = (first + count) & 0xFFFFFFFF
+        return [(first + i) & 0xFFFFFFFF for i in range(count)]
+
+
+class SigningServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, private_keys):
+        """
+        Local signing daemon holding merchant private keys.
+        Serves `RemoteSigner` clients over a Unix socket, one thread per connection.
+        Requests on a connection are answered in the order they were sent
+        :param str socket_path: path of the Unix socket to listen on
+        :param dict private_keys: public key ID => path of private key or the private key content.
+            Requests with an empty key ID are signed with the key if only one is configured
+        """
+        self.socket_path = socket_path
+        self.signers = {public_key_id: LocalSigner(private_key) for public_key_id, private_key in private_keys.items()}
+        for signer in self.signers.values():
+            signer.load()
+
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        # bind with owner-only permissions, so that no other user can connect before the socket is restricted
+        umask = os.umask(0o177)
+        try:
+            super().__init__(socket_path, SigningRequestHandler)
+        finally:
+            os.umask(umask)
+        os.chmod(socket_path, 0o600)
+
+    def sign(self, key_id, data):
+        if key_id == '' and len(self.signers) == 1:
+            signer = next(iter(self.signers.values()))
+        elif key_id in self.signers:
+            signer = self.signers[key_id]
+        else:
+            raise SigningError('Unknown public key ID [' + key_id + '].')
+
+        return signer.sign_raw(data)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+
+class SigningRequestHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        while True:
+            try:
+                request_id, op, key_id, payload = read_request(self.request)
+            except EOFError:
+                return
+
+            try:
+                if op != OP_SIGN:
+                    raise SigningError('Unknown operation ' + str(op) + '.')
+                response = encode_response(request_id, STATUS_OK, self.server.sign(key_id.decode(), payload))
+            except Exception as e:
+                response = encode_response(request_id, STATUS_ERROR, str(e).encode())
+
+            self.request.sendall(response)
+
+
+def _reset_signers():
+    for signer in list(_signers):
+        signer.reset()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_signers)
+
+
+def encode_request(request_id, op, key_id, payload):
+    return REQUEST_HEADER.pack(request_id, op, len(key_id), len(payload)) + key_id + payload
+
+
+def encode_response(request_id, status, body):
+    return RESPONSE_HEADER.pack(request_id, status, len(body)) + body
+
+
+def read_request(connection):
+    request_id, op, key_id_length, payload_length = REQUEST_HEADER.unpack(_read_exactly(connection, REQUEST_HEADER.size))
+    key_id = _read_exactly(connection, key_id_length)
+    payload = _read_exactly(connection, payload_length)
+    return request_id, op, key_id, payload
+
+
+def read_response(connection):
+    request_id, status, length = RESPONSE_HEADER.unpack(_read_exactly(connection, RESPONSE_HEADER.size))
+    return request_id, status, _read_exactly(connection, length)
+
+
+def _read_exactly(connection, size):
+    buffer = bytearray()
+    while len(buffer) < size:
+        chunk = connection.recv(size - len(buffer))
+        if not chunk:
+            raise EOFError('Connection closed.')
+        buffer += chunk
+    return bytes(buffer)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Amazon Pay signing server')
+    parser.add_argument('--socket', required=True, help='path of the Unix socket to listen on')
+    parser.add_argument('--key', action='append', required=True, metavar='PUBLIC_KEY_ID=PRIVATE_KEY_PATH',
+                        help='private key to serve, may be given multiple times')
+    args = parser.parse_args(argv)
+
+    private_keys = {}
+    for key in args.key:
+        public_key_id, _, private_key = key.partition('=')
+        if not private_key:
+            parser.error('invalid --key ' + key)
+        private_keys[public_key_id] = private_key
+
+    with SigningServer(args.socket, private_keys) as server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+import unittest
+from unittest import mock
+import requests
+from AmazonPay import Client, CircuitBreaker, CircuitOpenError, SigningError
+from AmazonPay.circuit_breaker import CLOSED, OPEN, HALF_OPEN
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeResponse:
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class StaticSigner:
+
+    def sign(self, string_to_sign, public_key_id=None):
+        return 'signature'
+
+
+class FailingSigner:
+
+    def __init__(self, clock):
+        self.clock = clock
+
+    def sign(self, string_to_sign, public_key_id=None):
+        self.clock.now += 10.0
+        raise SigningError('Signing server is not available.')
+
+
+class Interrupted(BaseException):
+    pass
+
+
+class AmazonPayCircuitBreakerTest(unittest.TestCase):
+
+    KEY = ('pay-api.amazon.jp', 'GET /charges/{id}')
+
+    def test_opens_on_failure_rate(self):
+        for _ in range(4):
+            self.breaker.call(self.KEY, lambda: FakeResponse(200))
+        for _ in range(4):
+            self.breaker.call(self.KEY, lambda: FakeResponse(503))
+
+        self.assertEqual(self.breaker.state(self.KEY), OPEN)
+        with self.assertRaises(CircuitOpenError) as context:
+            self.breaker.call(self.KEY, lambda: self.fail('must not be called'))
+        self.assertEqual(context.exception.key, self.KEY)
+        self.assertEqual(context.exception.retry_after, 30.0)
+
+    def test_exceptions_are_failures(self):
+        for _ in range(8):
+            with self.assertRaises(requests.ConnectionError):
+                self.breaker.call(self.KEY, self.raise_connection_error)
+
+        self.assertEqual(self.breaker.state(self.KEY), OPEN)
+
+    def test_opens_on_slow_calls(self):
+        self.breaker.slow_call_duration = 5.0
+
+        for _ in range(8):
+            self.breaker.call(self.KEY, self.slow_response)
+
+        self.assertEqual(self.breaker.state(self.KEY), OPEN)
+
+    def test_circuits_are_independent(self):
+        self.trip()
+
+        self.assertEqual(self.breaker.state(('pay-api.amazon.eu', 'GET /charges/{id}')), CLOSED)
+        self.breaker.call(('pay-api.amazon.eu', 'GET /charges/{id}'), lambda: FakeResponse(200))
+
+    def test_half_open_probe_closes(self):
+        self.trip()
+        self.clock.now += 30.0
+
+        self.breaker.call(self.KEY, lambda: FakeResponse(200))
+
+        self.assertEqual(self.breaker.state(self.KEY), CLOSED)
+        self.assertEqual(self.transitions, [(self.KEY, CLOSED, OPEN), (self.KEY, OPEN, HALF_OPEN), (self.KEY, HALF_OPEN, CLOSED)])
+
+    def test_half_open_probe_reopens(self):
+        self.trip()
+        self.clock.now += 30.0
+
+        self.breaker.call(self.KEY, lambda: FakeResponse(500))
+
+        self.assertEqual(self.breaker.state(self.KEY), OPEN)
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.call(self.KEY, lambda: FakeResponse(200))
+
+    def test_half_open_limits_probes(self):
+        self.trip()
+        self.clock.now += 30.0
+
+        def probe():
+            with self.assertRaises(CircuitOpenError):
+                self.breaker.call(self.KEY, lambda: FakeResponse(200))
+            return FakeResponse(200)
+
+        self.breaker.call(self.KEY, probe)
+
+        self.assertEqual(self.breaker.state(self.KEY), CLOSED)
+
+    def test_other_exceptions_are_not_failures(self):
+        for _ in range(8):
+            with self.assertRaises(ValueError):
+                self.breaker.call(self.KEY, self.raise_value_error)
+
+        self.assertEqual(self.breaker.state(self.KEY), CLOSED)
+
+    def test_interrupted_probe_releases_slot(self):
+        self.trip()
+        self.clock.now += 30.0
+
+        with self.assertRaises(Interrupted):
+            self.breaker.call(self.KEY, self.raise_interrupted)
+        self.breaker.call(self.KEY, lambda: FakeResponse(200))
+
+        self.assertEqual(self.breaker.state(self.KEY), CLOSED)
+
+    def test_stale_calls_are_not_probes(self):
+        self.breaker.half_open_max_calls = 3
+
+        def outlive_outage():
+            self.trip()
+            self.clock.now += 30.0
+            self.breaker.call(self.KEY, lambda: FakeResponse(200))
+            return FakeResponse(200)
+
+        self.breaker.call(self.KEY, outlive_outage)
+        self.breaker.call(self.KEY, lambda: FakeResponse(200))
+
+        self.assertEqual(self.breaker.state(self.KEY), HALF_OPEN)
+
+        self.breaker.call(self.KEY, lambda: FakeResponse(200))
+
+        self.assertEqual(self.breaker.state(self.KEY), CLOSED)
+
+    def test_failing_listener(self):
+        def listener(key, old_state, new_state):
+            raise RuntimeError('metrics backend is down')
+
+        self.breaker.add_listener(listener)
+        self.trip()
+        self.clock.now += 30.0
+
+        with self.assertLogs('AmazonPay.circuit_breaker', 'ERROR'):
+            response = self.breaker.call(self.KEY, lambda: FakeResponse(201))
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.breaker.state(self.KEY), CLOSED)
+        self.assertEqual(self.transitions[-2:], [(self.KEY, OPEN, HALF_OPEN), (self.KEY, HALF_OPEN, CLOSED)])
+
+    def test_failing_listener_keeps_probe_slot(self):
+        def listener(key, old_state, new_state):
+            if new_state == HALF_OPEN:
+                raise RuntimeError('metrics backend is down')
+
+        self.breaker.add_listener(listener)
+        self.trip()
+        self.clock.now += 30.0
+
+        with self.assertLogs('AmazonPay.circuit_breaker', 'ERROR'):
+            self.breaker.call(self.KEY, lambda: FakeResponse(500))
+        self.clock.now += 30.0
+        with self.assertLogs('AmazonPay.circuit_breaker', 'ERROR'):
+            self.breaker.call(self.KEY, lambda: FakeResponse(200))
+
+        self.assertEqual(self.breaker.state(self.KEY), CLOSED)
+
+    def test_client_signing_errors_are_not_failures(self):
+        self.breaker.slow_call_duration = 5.0
+        client = Client('LIVE-TEST', region='jp', signer=FailingSigner(self.clock), circuit_breaker=self.breaker)
+
+        with mock.patch.object(requests.Session, 'request') as request:
+            for i in range(8):
+                with self.assertRaises(SigningError):
+                    client.get_charge(f'S01-0000000-0000000-C{i:06d}')
+
+        request.assert_not_called()
+        self.assertNotIn(OPEN, self.breaker.states().values())
+
+    def test_client_fails_fast(self):
+        client = Client('LIVE-TEST', region='jp', signer=StaticSigner(), circuit_breaker=self.breaker)
+
+        with mock.patch.object(requests.Session, 'request', return_value=FakeResponse(503)) as request:
+            for i in range(8):
+                client.get_charge(f'S01-0000000-0000000-C{i:06d}')
+            with self.assertRaises(CircuitOpenError):
+                client.get_charge('S01-0000000-0000000-C000008')
+            client.get_charge_permission('S01-0000000-0000000')
+
+        self.assertEqual(request.call_count, 9)
+        self.assertEqual(self.breaker.states(), {
+            ('pay-api.amazon.jp', 'GET /charges/{id}'): OPEN,
+            ('pay-api.amazon.jp', 'GET /chargePermissions/{id}'): CLOSED,
+        })
+
+    def trip(self):
+        for _ in range(8):
+            self.breaker.call(self.KEY, lambda: FakeResponse(503))
+
+    def slow_response(self):
+        self.clock.now += 6.0
+        return FakeResponse(200)
+
+    @staticmethod
+    def raise_connection_error():
+        raise requests.ConnectionError()
+
+    @staticmethod
+    def raise_value_error():
+        raise ValueError()
+
+    @staticmethod
+    def raise_interrupted():
+        raise Interrupted()
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.transitions = []
+        self.breaker = CircuitBreaker(
+            window_size=8,
+            minimum_calls=8,
+            open_duration=30.0,
+            on_state_change=lambda key, old_state, new_state: self.transitions.append((key, old_state, new_state)),
+            clock=self.clock
+        )
@@ -0,0 +1,96 @@
+import os
+import tempfile
+import unittest
+from Crypto.PublicKey import RSA
+from AmazonPay import Client, CircuitBreaker
+from AmazonPay.circuit_breaker import CLOSED
+
+
+class FakeResponse:
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+@unittest.skipUnless(hasattr(os, 'fork'), 'requires os.fork')
+class AmazonPayForkTest(unittest.TestCase):
+
+    def test_warm_up(self):
+        self.client.warm_up()
+
+        self.assertIsNotNone(self.client.signer._LocalSigner__rsa)
+
+    def test_child_inherits_key(self):
+        self.client.warm_up()
+        rsa = self.client.signer._LocalSigner__rsa
+
+        self.assertEqual(self.in_child(lambda: self.client.signer._LocalSigner__rsa is rsa), b'1')
+
+    def test_child_rebuilds_transport(self):
+        transport = self.client._Client__transport
+        session = transport.get_session()
+
+        self.assertEqual(self.in_child(lambda: transport.get_session() is not session and transport.pid == os.getpid()), b'1')
+        self.assertIs(transport.get_session(), session)
+
+    def test_derived_clients_share_rebuilt_transport(self):
+        derived = self.client.with_config(region='eu')
+
+        self.assertEqual(self.in_child(lambda: derived._Client__transport.get_session() is self.client._Client__transport.get_session()), b'1')
+
+    def test_child_resets_circuit_breaker_lock(self):
+        breaker = CircuitBreaker()
+        lock = breaker._CircuitBreaker__lock
+        lock.acquire()
+        try:
+            result = self.in_child(lambda: breaker._CircuitBreaker__lock.acquire(timeout=1))
+        finally:
+            lock.release()
+
+        self.assertEqual(result, b'1')
+
+    def test_child_releases_parent_probes(self):
+        now = [0.0]
+        breaker = CircuitBreaker(window_size=1, minimum_calls=1, clock=lambda: now[0])
+        key = ('pay-api.amazon.jp', 'GET /charges/{id}')
+        breaker.call(key, lambda: FakeResponse(503))
+        now[0] += 30.0
+
+        def probe_in_child():
+            breaker.call(key, lambda: FakeResponse(200))
+            return breaker.state(key) == CLOSED
+
+        results = []
+        breaker.call(key, lambda: results.append(self.in_child(probe_in_child)) or FakeResponse(200))
+
+        self.assertEqual(results, [b'1'])
+
+    def in_child(self, check):
+        read, write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read)
+            try:
+                os.write(write, b'1' if check() else b'0')
+            finally:
+                os._exit(0)
+
+        os.close(write)
+        os.waitpid(pid, 0)
+        with os.fdopen(read, 'rb') as result:
+            return result.read()
+
+    @classmethod
+    def setUpClass(cls):
+        cls.rsa = RSA.generate(2048)
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        private_key_path = os.path.join(self.directory.name, 'private.pem')
+        with open(private_key_path, 'wb') as private_key:
+            private_key.write(self.rsa.export_key())
+
+        self.client = Client('SANDBOX-TEST', private_key_path, 'jp')
+
+    def tearDown(self):
+        self.directory.cleanup()
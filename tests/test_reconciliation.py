@@ -0,0 +1,144 @@
+import json
+import unittest
+from AmazonPay import Reconciler, SnapshotStore
+from AmazonPay.reconciliation import CHARGE, CHARGE_PERMISSION
+
+
+class FakeResponse:
+
+    def __init__(self, status_code, result):
+        self.status_code = status_code
+        self.result = result
+        self.content = json.dumps(result).encode()
+
+    def json(self):
+        return self.result
+
+
+class FakeClient:
+
+    def __init__(self):
+        self.objects = {}
+        self.calls = []
+
+    def get_charge_permission(self, charge_permission_id):
+        return self.__get(CHARGE_PERMISSION, charge_permission_id)
+
+    def get_charge(self, charge_id):
+        return self.__get(CHARGE, charge_id)
+
+    def __get(self, object_type, object_id):
+        self.calls.append((object_type, object_id))
+        if (object_type, object_id) not in self.objects:
+            return FakeResponse(404, {'reasonCode': 'ResourceNotFound'})
+
+        return FakeResponse(200, {'statusDetails': {'state': self.objects[(object_type, object_id)]}})
+
+
+class AmazonPayReconciliationTest(unittest.TestCase):
+
+    def test_first_run_reports_all(self):
+        changes = list(self.reconciler.run())
+
+        self.assertEqual(len(changes), 4)
+        self.assertTrue(all(change.previous_state is None for change in changes))
+
+    def test_unchanged_objects_are_not_reported(self):
+        list(self.reconciler.run())
+        self.client.objects[(CHARGE, 'S01-0000000-0000000-C000001')] = 'Captured'
+
+        changes = list(self.reconciler.run())
+
+        self.assertEqual(len(changes), 1)
+        self.assertEqual(changes[0].object_id, 'S01-0000000-0000000-C000001')
+        self.assertEqual(changes[0].previous_state, 'Authorized')
+        self.assertEqual(changes[0].state, 'Captured')
+
+    def test_terminal_objects_are_skipped(self):
+        list(self.reconciler.run())
+        self.client.calls = []
+
+        list(self.reconciler.run())
+
+        self.assertNotIn((CHARGE_PERMISSION, 'S01-0000000-0000002'), self.client.calls)
+        self.assertNotIn((CHARGE, 'S01-0000000-0000000-C000002'), self.client.calls)
+        self.assertEqual(len(self.client.calls), 2)
+
+    def test_transitional_objects_first(self):
+        self.client.objects[(CHARGE, 'S01-0000000-0000000-C000001')] = 'AuthorizationInitiated'
+        list(self.reconciler.run())
+
+        due = self.store.due(float('inf'))
+
+        self.assertEqual(due[0].state, 'AuthorizationInitiated')
+
+    def test_min_interval(self):
+        self.reconciler.min_interval = 3600
+        list(self.reconciler.run())
+        self.client.calls = []
+
+        list(self.reconciler.run())
+
+        self.assertEqual(self.client.calls, [])
+
+    def test_failures_are_collected(self):
+        self.reconciler.track(CHARGE, ['S01-0000000-0000000-C999999'])
+
+        list(self.reconciler.run())
+
+        self.assertEqual(len(self.reconciler.failures), 1)
+        self.assertEqual(self.reconciler.failures[0].object_id, 'S01-0000000-0000000-C999999')
+        self.assertIsNone(self.store.get(CHARGE, 'S01-0000000-0000000-C999999').last_checked)
+
+    def test_failed_objects_are_backed_off(self):
+        self.reconciler.track(CHARGE, ['S01-0000000-0000000-C999999'])
+        list(self.reconciler.run())
+        self.client.calls = []
+
+        list(self.reconciler.run())
+
+        self.assertNotIn((CHARGE, 'S01-0000000-0000000-C999999'), self.client.calls)
+        self.assertEqual(self.store.get(CHARGE, 'S01-0000000-0000000-C999999').failures, 1)
+
+    def test_failed_objects_do_not_use_up_limit(self):
+        self.reconciler.failure_backoff = 0
+        self.reconciler.track(CHARGE_PERMISSION, ['S01-0000000-9999998', 'S01-0000000-9999999'])
+        for _ in range(3):
+            list(self.reconciler.run(limit=2))
+        self.client.calls = []
+
+        list(self.reconciler.run(limit=2))
+
+        self.assertEqual(sorted(self.client.calls), [
+            (CHARGE, 'S01-0000000-0000000-C000001'),
+            (CHARGE_PERMISSION, 'S01-0000000-0000001'),
+        ])
+
+    def test_stopping_early_skips_remaining_checks(self):
+        object_ids = [f'S01-0000000-{i:07d}' for i in range(200)]
+        for object_id in object_ids:
+            self.client.objects[(CHARGE_PERMISSION, object_id)] = 'Chargeable'
+        self.reconciler.track(CHARGE_PERMISSION, object_ids)
+
+        for _ in self.reconciler.run():
+            break
+
+        self.assertLess(len(self.client.calls), 20)
+        for object_type, object_id in self.client.calls:
+            self.assertIsNotNone(self.store.get(object_type, object_id).last_checked)
+
+    def setUp(self):
+        self.client = FakeClient()
+        self.client.objects = {
+            (CHARGE_PERMISSION, 'S01-0000000-0000001'): 'Chargeable',
+            (CHARGE_PERMISSION, 'S01-0000000-0000002'): 'Closed',
+            (CHARGE, 'S01-0000000-0000000-C000001'): 'Authorized',
+            (CHARGE, 'S01-0000000-0000000-C000002'): 'Declined',
+        }
+        self.store = SnapshotStore()
+        self.reconciler = Reconciler(self.client, self.store, max_workers=4)
+        self.reconciler.track(CHARGE_PERMISSION, ['S01-0000000-0000001', 'S01-0000000-0000002'])
+        self.reconciler.track(CHARGE, ['S01-0000000-0000000-C000001', 'S01-0000000-0000000-C000002'])
+
+    def tearDown(self):
+        self.store.close()
@@ -0,0 +1,133 @@
+import base64
+import concurrent.futures
+import os
+import socket
+import stat
+import tempfile
+import threading
+import time
+import unittest
+from Crypto.Hash import SHA256
+from Crypto.PublicKey import RSA
+from Crypto.Signature import pss
+from AmazonPay import Client, LocalSigner, RemoteSigner, SigningServer, SigningError
+
+
+class AmazonPaySignerTest(unittest.TestCase):
+
+    def test_local_signer(self):
+        signer = LocalSigner(self.private_key_path)
+
+        self.assertValidSignature('AMZN-PAY-RSASSA-PSS\nabc', signer.sign('AMZN-PAY-RSASSA-PSS\nabc'))
+
+    def test_local_signer_with_key_content(self):
+        signer = LocalSigner(self.rsa.export_key().decode())
+
+        self.assertValidSignature('AMZN-PAY-RSASSA-PSS\nabc', signer.sign('AMZN-PAY-RSASSA-PSS\nabc'))
+
+    def test_remote_signer(self):
+        signer = RemoteSigner(self.socket_path, 'SANDBOX-TEST')
+
+        self.assertValidSignature('AMZN-PAY-RSASSA-PSS\nabc', signer.sign('AMZN-PAY-RSASSA-PSS\nabc'))
+        self.assertValidSignature('AMZN-PAY-RSASSA-PSS\ndef', signer.sign('AMZN-PAY-RSASSA-PSS\ndef'))
+
+        signer.close()
+
+    def test_remote_signer_pipelining(self):
+        signer = RemoteSigner(self.socket_path, 'SANDBOX-TEST')
+        strings_to_sign = ['AMZN-PAY-RSASSA-PSS\n' + str(i) for i in range(50)]
+
+        signatures = signer.sign_many(strings_to_sign)
+
+        self.assertEqual(len(signatures), len(strings_to_sign))
+        for string_to_sign, signature in zip(strings_to_sign, signatures):
+            self.assertValidSignature(string_to_sign, signature)
+
+        signer.close()
+
+    def test_remote_signer_unknown_key(self):
+        signer = RemoteSigner(self.socket_path, 'SANDBOX-UNKNOWN')
+
+        with self.assertRaises(SigningError):
+            signer.sign('AMZN-PAY-RSASSA-PSS\nabc')
+
+        signer.close()
+
+    def test_remote_signer_batches_concurrent_calls(self):
+        signer = RemoteSigner(self.socket_path, 'SANDBOX-TEST')
+        strings_to_sign = ['AMZN-PAY-RSASSA-PSS\n' + str(i) for i in range(100)]
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=16) as executor:
+            signatures = list(executor.map(signer.sign, strings_to_sign))
+
+        for string_to_sign, signature in zip(strings_to_sign, signatures):
+            self.assertValidSignature(string_to_sign, signature)
+
+        signer.close()
+
+    def test_remote_signer_does_not_retry_timeout(self):
+        socket_path = os.path.join(self.directory.name, 'hung.sock')
+        hung = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        hung.bind(socket_path)
+        hung.listen(8)
+        signer = RemoteSigner(socket_path, timeout=0.5)
+
+        started_at = time.monotonic()
+        with self.assertRaises(socket.timeout):
+            signer.sign('AMZN-PAY-RSASSA-PSS\nabc')
+
+        self.assertLess(time.monotonic() - started_at, 0.9)
+        hung.close()
+
+    def test_signing_server_socket_permissions(self):
+        self.assertEqual(stat.S_IMODE(os.stat(self.socket_path).st_mode), 0o600)
+
+    def test_client_with_remote_signer(self):
+        client = Client(public_key_id='SANDBOX-TEST', region='jp', signer=RemoteSigner(self.socket_path, 'SANDBOX-TEST'))
+        payload = '{"storeId":"amzn1.application-oa2-client.test"}'
+
+        signature = client.generate_button_signature(payload)
+
+        self.assertValidSignature('AMZN-PAY-RSASSA-PSS\n' + SHA256.new(payload.encode()).hexdigest(), signature)
+
+        client.signer.close()
+
+    def test_derived_client_signs_with_its_public_key_id(self):
+        client = Client(public_key_id='SANDBOX-TEST', region='jp', signer=RemoteSigner(self.socket_path, 'SANDBOX-TEST'))
+        derived = client.with_config(public_key_id='SANDBOX-OTHER', region='eu')
+        unknown = client.with_config(public_key_id='SANDBOX-UNKNOWN')
+        payload = '{"storeId":"amzn1.application-oa2-client.test"}'
+        string_to_sign = 'AMZN-PAY-RSASSA-PSS\n' + SHA256.new(payload.encode()).hexdigest()
+
+        self.assertValidSignature(string_to_sign, client.generate_button_signature(payload))
+        self.assertValidSignature(string_to_sign, derived.generate_button_signature(payload), self.other_rsa)
+        with self.assertRaises(SigningError):
+            unknown.generate_button_signature(payload)
+
+        client.signer.close()
+
+    def assertValidSignature(self, string_to_sign, signature, rsa=None):
+        pss.new((rsa or self.rsa).public_key(), salt_bytes=20).verify(SHA256.new(string_to_sign.encode()), base64.b64decode(signature))
+
+    @classmethod
+    def setUpClass(cls):
+        cls.rsa = RSA.generate(2048)
+        cls.other_rsa = RSA.generate(2048)
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.private_key_path = os.path.join(self.directory.name, 'private.pem')
+        with open(self.private_key_path, 'wb') as private_key:
+            private_key.write(self.rsa.export_key())
+
+        self.socket_path = os.path.join(self.directory.name, 'signer.sock')
+        self.server = SigningServer(self.socket_path, {
+            'SANDBOX-TEST': self.private_key_path,
+            'SANDBOX-OTHER': self.other_rsa.export_key().decode(),
+        })
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.directory.cleanup()
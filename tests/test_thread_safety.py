@@ -0,0 +1,169 @@
+import concurrent.futures
+import http.server
+import threading
+import unittest
+import urllib.parse
+from unittest import mock
+import requests
+from AmazonPay import Client
+
+
+class TenantSigner:
+
+    def __init__(self, tenant):
+        self.tenant = tenant
+
+    def sign(self, string_to_sign, public_key_id=None):
+        return self.tenant
+
+
+class AmazonPayThreadSafetyTest(unittest.TestCase):
+
+    TENANTS = {
+        'LIVE-TENANT-JP': 'jp',
+        'LIVE-TENANT-EU': 'eu',
+        'LIVE-TENANT-NA': 'us',
+    }
+
+    HOSTS = {
+        'jp': 'pay-api.amazon.jp',
+        'eu': 'pay-api.amazon.eu',
+        'us': 'pay-api.amazon.com',
+    }
+
+    def test_setup_does_not_mix_configurations(self):
+        client = Client()
+        self.setup_tenant(client, 'LIVE-TENANT-JP')
+        stop = threading.Event()
+
+        def reconfigure():
+            tenants = list(self.TENANTS)
+            i = 0
+            while not stop.is_set():
+                self.setup_tenant(client, tenants[i % len(tenants)])
+                i += 1
+
+        with mock.patch.object(requests.Session, 'request') as request:
+            reconfigurer = threading.Thread(target=reconfigure)
+            reconfigurer.start()
+            try:
+                with concurrent.futures.ThreadPoolExecutor(max_workers=16) as executor:
+                    list(executor.map(lambda i: client.get_charge(f'S01-0000000-0000000-C{i:06d}'), range(2000)))
+            finally:
+                stop.set()
+                reconfigurer.join()
+
+        self.assertEqual(request.call_count, 2000)
+        for call in request.call_args_list:
+            self.assertConsistent(call)
+
+    def test_with_config_shares_resources(self):
+        client = Client('LIVE-TENANT-JP', region='jp', signer=TenantSigner('LIVE-TENANT-JP'))
+
+        derived = client.with_config(public_key_id='LIVE-TENANT-EU', region='eu')
+
+        self.assertIs(derived.signer, client.signer)
+        self.assertIs(derived._Client__transport, client._Client__transport)
+        self.assertEqual(client.config.public_key_id, 'LIVE-TENANT-JP')
+        self.assertEqual(client.endpoint, 'https://pay-api.amazon.jp')
+        self.assertEqual(derived.config.public_key_id, 'LIVE-TENANT-EU')
+        self.assertEqual(derived.endpoint, 'https://pay-api.amazon.eu')
+
+    def test_endpoint_can_be_overridden(self):
+        client = Client('LIVE-TENANT-JP', region='jp', signer=TenantSigner('LIVE-TENANT-JP'))
+        derived = client.with_config(endpoint='http://localhost:8080')
+
+        client.endpoint = 'http://127.0.0.1:8080'
+
+        self.assertEqual(client.config.headers['X-Amz-Pay-Host'], '127.0.0.1:8080')
+        self.assertEqual(derived.endpoint, 'http://localhost:8080')
+        self.assertEqual(derived.config.headers['X-Amz-Pay-Host'], 'localhost:8080')
+        self.assertEqual(derived.with_config(public_key_id='LIVE-TENANT-EU').endpoint, 'http://localhost:8080')
+        self.assertEqual(derived.with_config(region='eu').endpoint, 'https://pay-api.amazon.eu')
+
+    def test_with_config_rejects_headers(self):
+        client = Client('LIVE-TENANT-JP', region='jp', signer=TenantSigner('LIVE-TENANT-JP'))
+
+        with self.assertRaises(TypeError):
+            client.with_config(headers={'X-Amz-Pay-Host': 'example.com'})
+
+    def test_config_headers_are_read_only(self):
+        client = Client('LIVE-TENANT-JP', region='jp', signer=TenantSigner('LIVE-TENANT-JP'))
+        derived = client.with_config(public_key_id='LIVE-TENANT-EU')
+
+        with self.assertRaises(TypeError):
+            client.config.headers['X-Amz-Pay-Host'] = 'example.com'
+
+        self.assertEqual(derived.config.headers['X-Amz-Pay-Host'], 'pay-api.amazon.jp')
+
+    def test_with_config_concurrently(self):
+        base = Client(region='jp')
+        clients = [
+            base.with_config(public_key_id=public_key_id, region=region, signer=TenantSigner(public_key_id))
+            for public_key_id, region in self.TENANTS.items()
+        ]
+
+        with mock.patch.object(requests.Session, 'request') as request:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=16) as executor:
+                list(executor.map(lambda i: clients[i % len(clients)].get_charge_permission(f'S01-0000000-{i:07d}'), range(2000)))
+
+        self.assertEqual(request.call_count, 2000)
+        for call in request.call_args_list:
+            self.assertConsistent(call)
+
+    def test_sessions_per_thread_share_connection_pool(self):
+        transport = Client(region='jp')._Client__transport
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+            sessions = list(executor.map(lambda _: transport.get_session(), range(4)))
+
+        self.assertIsNot(sessions[0], transport.get_session())
+        for session in sessions:
+            self.assertIs(session.get_adapter('https://pay-api.amazon.jp'), transport.adapter)
+
+    def test_cookies_are_not_stored(self):
+        cookies = []
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                cookies.append(self.headers.get('Cookie'))
+                self.send_response(200)
+                self.send_header('Set-Cookie', 'session-id=merchant-a')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        server = http.server.HTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            client = Client(region='jp')
+            derived = client.with_config(region='eu')
+            url = 'http://127.0.0.1:' + str(server.server_address[1]) + '/'
+
+            client._Client__transport.get_session().get(url)
+            derived._Client__transport.get_session().get(url)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual(cookies, [None, None])
+
+    def setup_tenant(self, client, public_key_id):
+        client.setup(public_key_id, region=self.TENANTS[public_key_id], signer=TenantSigner(public_key_id))
+
+    def assertConsistent(self, call):
+        method, url = call.args
+        headers = call.kwargs['headers']
+        authorization = dict(
+            part.strip().split('=', 1) for part in headers['Authorization'][len('AMZN-PAY-RSASSA-PSS '):].split(',')
+        )
+        public_key_id = authorization['PublicKeyId']
+        host = self.HOSTS[self.TENANTS[public_key_id]]
+
+        self.assertEqual(authorization['Signature'], public_key_id)
+        self.assertEqual(headers['X-Amz-Pay-Region'], self.TENANTS[public_key_id])
+        self.assertEqual(headers['X-Amz-Pay-Host'], host)
+        self.assertEqual(urllib.parse.urlparse(url).netloc, host)